@@ -1,25 +1,35 @@
-from flask import Blueprint, redirect, session, jsonify, url_for, request, make_response
+from flask import Blueprint, redirect, session, jsonify, url_for, request, make_response, current_app
 from authlib.integrations.flask_client import OAuth
-import os
-from dotenv import load_dotenv
-import time
+from app.config import CFG
 import logging
 import secrets
+import requests
 
 logger = logging.getLogger(__name__)
 auth_bp = Blueprint('auth', __name__)
 oauth = OAuth()
 
+# OIDC discovery document (plus its JWKS), fetched once at startup
+server_metadata = {}
+
+def load_server_metadata(server_metadata_url):
+    """Fetch the OIDC discovery document and the JWKS it points to"""
+    response = requests.get(server_metadata_url, timeout=10)
+    response.raise_for_status()
+    metadata = response.json()
+
+    jwks_response = requests.get(metadata['jwks_uri'], timeout=10)
+    jwks_response.raise_for_status()
+    metadata['jwks'] = jwks_response.json()
+    return metadata
+
 def init_app(app):
     oauth.init_app(app)
     
-    # Load environment variables
-    load_dotenv()
-    
-    client_id = os.getenv('CLIENT_ID')
-    client_secret = os.getenv('CLIENT_SECRET')
-    cognito_idp_domain = os.getenv('COGNITO_IDP_DOMAIN')
-    user_pool_id = os.getenv('USER_POOL_ID')
+    client_id = CFG.CLIENT_ID
+    client_secret = CFG.CLIENT_SECRET
+    cognito_idp_domain = CFG.COGNITO_IDP_DOMAIN
+    user_pool_id = CFG.USER_POOL_ID
 
     
     if not all([client_id, client_secret, cognito_idp_domain, user_pool_id]):
@@ -29,15 +39,18 @@ def init_app(app):
     server_metadata_url = f"https://{cognito_idp_domain}/{user_pool_id}/.well-known/openid-configuration"
     logger.info(f"Using server metadata URL: {server_metadata_url}")
 
+    # Pass the metadata and keys in directly so authlib never fetches them per login
+    server_metadata.update(load_server_metadata(server_metadata_url))
+
     oauth.register(
         name='cognito',
         client_id=client_id,
         client_secret=client_secret,
-        server_metadata_url=server_metadata_url,
         client_kwargs={
             'scope': 'openid email profile',
             'response_type': 'code'
-        }
+        },
+        **server_metadata
     )
     
     logger.info("OAuth client registration complete")
@@ -86,6 +99,10 @@ def authorize():
         userinfo = oauth.cognito.parse_id_token(token, nonce=nonce)
         logger.info(f"User info: {userinfo}")
         
+        # Move to a fresh session ID so an ID planted before login (session fixation) never
+        # becomes an authenticated session; regenerate() skips empty sessions, so do it before clearing
+        current_app.session_interface.regenerate(session)
+
         # Store in session
         session.clear()  
         session.permanent = True
@@ -96,7 +113,6 @@ def authorize():
         }
         session['access_token'] = token.get('access_token')
         session['id_token'] = token.get('id_token')
-        session['session_expiry'] = time.time() + 3600  
         session.modified = True
         
         logger.info("Session data stored successfully")
@@ -108,17 +124,14 @@ def authorize():
 
 @auth_bp.route('/check-session')
 def check_session():
-    logger.info(f"Session check requested. Current session: {dict(session)}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Session check: user=%s", session.get('user', {}).get('user_id'))
     
+    # Expired sessions are evicted by the Redis TTL, so a missing user covers both cases
     if 'user' not in session:
         logger.warning("No user in session")
         return jsonify({"authenticated": False}), 401
         
-    if 'session_expiry' in session and time.time() > session['session_expiry']:
-        logger.warning("Session expired")
-        session.clear()
-        return jsonify({"authenticated": False, "reason": "expired"}), 401
-        
     return jsonify({
         "authenticated": True,
         "user": session['user']
@@ -129,10 +142,9 @@ def logout():
     logger.info("Logout requested")
     session.clear()
 
-    # Fetch environment variables
-    client_id = os.getenv('CLIENT_ID')
-    logout_url = os.getenv('COGNITO_LOGOUT_URL')
-    redirect_url = os.getenv('COGNITO_REDIRECT_URL')
+    client_id = CFG.CLIENT_ID
+    logout_url = CFG.COGNITO_LOGOUT_URL
+    redirect_url = CFG.COGNITO_REDIRECT_URL
 
     # Validate environment variables
     if not all([client_id, logout_url, redirect_url]):
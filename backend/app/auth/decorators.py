@@ -1,27 +1,75 @@
-from functools import wraps
-from flask import session, jsonify, request
+from functools import wraps, lru_cache
+from flask import session, jsonify, request, g
+from authlib.jose import JsonWebToken, JsonWebKey
+from app.auth import cognito_service
+from app.config import CFG
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Cognito signs ID tokens with RS256; accepting any other algorithm opens the door to algorithm confusion
+jwt = JsonWebToken(['RS256'])
+
+@lru_cache(maxsize=1)
+def get_key_set():
+    """Build the Cognito key set from the JWKS cached at startup"""
+    return JsonWebKey.import_key_set(cognito_service.server_metadata['jwks'])
+
+@lru_cache(maxsize=4096)
+def decode_id_token(token):
+    """
+    Verify a Cognito ID token against the cached JWKS and return its claims.
+    Results are memoized per token, so repeated requests skip the RSA check;
+    expiry is still validated by the caller on every hit.
+    """
+    claims = jwt.decode(
+        token,
+        get_key_set(),
+        claims_options={
+            'iss': {'essential': True, 'value': cognito_service.server_metadata['issuer']},
+            'aud': {'essential': True, 'value': CFG.CLIENT_ID},
+            'token_use': {'essential': True, 'value': 'id'}
+        }
+    )
+    claims.validate()
+    return claims
+
+def get_bearer_user():
+    """Return the user for a valid `Authorization: Bearer` ID token, or None"""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+
+    try:
+        claims = decode_id_token(auth_header[len('Bearer '):])
+        # Cached claims outlive their token, so re-check expiry on every hit
+        claims.validate_exp(int(time.time()), 0)
+    except Exception as e:
+        # Any decode failure (bad signature, wrong algorithm, malformed token) just means no bearer user
+        logger.debug("Rejected bearer token: %r", e)
+        return None
+
+    return {
+        'user_id': claims.get('sub'),
+        'email': claims.get('email'),
+        'name': claims.get('name', claims.get('email'))
+    }
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Allow OPTIONS requests to pass through
-        if request.method == 'OPTIONS':
-            return f(*args, **kwargs)
-            
-        if 'user' not in session:
-            logger.warning("Unauthorized access attempt - no user in session")
-            return jsonify({"error": "Authentication required"}), 401
-            
-        # Check if session is expired
-        if 'session_expiry' in session:
-            import time
-            if time.time() > session['session_expiry']:
-                logger.warning("Unauthorized access attempt - session expired")
-                session.clear()
-                return jsonify({"error": "Session expired"}), 401
-                
+        # CORS preflights never reach here: Flask answers OPTIONS automatically
+        # and flask-cors adds the headers
+        # Prefer a locally verified bearer token, fall back to the session cookie
+        user = get_bearer_user()
+        if user is None:
+            # Expired sessions are evicted by the Redis TTL, so no expiry check is needed here
+            user = session.get('user')
+            if user is None:
+                logger.warning("Unauthorized access attempt - no user in session")
+                return jsonify({"error": "Authentication required"}), 401
+
+        g.user = user
         return f(*args, **kwargs)
-    return decorated_function 
\ No newline at end of file
+    return decorated_function
@@ -1,31 +1,62 @@
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, g, current_app, stream_with_context
 from app.auth.decorators import login_required
 import boto3
+import redis
 from botocore.config import Config
-import json
+from botocore.auth import S3SigV4QueryAuth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+import orjson
 from datetime import datetime
 import time
-import uuid
-import os
+import hmac
+import hashlib
 import logging
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
+from ulid import ULID
+from app.config import CFG
 
 
 logger = logging.getLogger(__name__)
 clinical_data_bp = Blueprint('clinical_data', __name__)
 
-def get_s3_client():
-    """Create and configure S3 client with error checking"""
+# Background workers for S3 writes that the client doesn't need to wait for
+metadata_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='metadata')
+
+# Per-user /trending/all responses are cached in Redis for this many seconds
+TRENDING_CACHE_TTL = 60
+# Bodies larger than this (in characters) aren't cached, so streaming them never buffers a full copy
+TRENDING_CACHE_MAX_CHARS = 256 * 1024
+
+# Attributes a /trending/all caller may request via ?fields=
+TRENDING_FIELDS = frozenset([
+    'UserId', 'PatientId#TestDateTime#Indicator', 'PatientId', 'PatientName', 'CollectedDate',
+    'UploadDate', 'LaboratoryName', 'Indicator', 'Result', 'Units', 'LowerRange', 'UpperRange',
+    'S3FileKey'
+])
+# What the dashboard charts need
+DEFAULT_TRENDING_FIELDS = ('Indicator', 'CollectedDate', 'Result', 'Units', 'LowerRange', 'UpperRange', 'LaboratoryName')
+
+def validate_aws_env():
+    """Raise ValueError if any AWS environment variable is missing"""
     required_vars = ['AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_REGION', 'AWS_S3_BUCKET']
-    missing_vars = [var for var in required_vars if not os.getenv(var)]
+    missing_vars = [var for var in required_vars if not getattr(CFG, var)]
     
     if missing_vars:
         error_msg = f"Missing required environment variables: {', '.join(missing_vars)}"
         logger.error(error_msg)
         raise ValueError(error_msg)
+
+@lru_cache(maxsize=1)
+def get_s3_client():
+    """Create and configure S3 client with error checking (built once, then reused)"""
+    validate_aws_env()
     
-    region = os.getenv('AWS_REGION')
+    region = CFG.AWS_REGION
     logger.info(f"Initializing S3 client with region: {region}")
     
     # Create a configuration object
@@ -37,31 +68,71 @@ def get_s3_client():
     
     return boto3.client(
         's3',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+        aws_access_key_id=CFG.AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=CFG.AWS_SECRET_ACCESS_KEY,
         region_name=region,
         config=config
     )
 
+@lru_cache(maxsize=1)
+def get_signing_credentials():
+    """Frozen AWS credentials used to presign URLs locally (built once, then reused)"""
+    validate_aws_env()
+    return Credentials(CFG.AWS_ACCESS_KEY_ID, CFG.AWS_SECRET_ACCESS_KEY)
+
+@lru_cache(maxsize=1)
+def get_clinical_reports_table():
+    """Return the clinical_reports DynamoDB table (built once, then reused)"""
+    return boto3.resource('dynamodb').Table('clinical_reports')
+
+@lru_cache(maxsize=8)
+def derive_signing_key(secret_key, date, region, service):
+    """SigV4 signing key; it only changes with the date, so it's derived once per day"""
+    key = f"AWS4{secret_key}".encode()
+    for part in (date, region, service, 'aws4_request'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return key
+
+class CachedKeyS3SigV4QueryAuth(S3SigV4QueryAuth):
+    """S3SigV4QueryAuth that reuses the derived signing key across requests"""
+
+    def signature(self, string_to_sign, request):
+        signing_key = derive_signing_key(
+            self.credentials.secret_key,
+            request.context['timestamp'][0:8],
+            self._region_name,
+            self._service_name
+        )
+        return self._sign(signing_key, string_to_sign, hex=True)
+
+def trending_cache_key(user_id):
+    return f"trending:{user_id}"
+
+def invalidate_trending_cache(user_id):
+    """Drop the cached /trending/all responses (every field selection) for a user"""
+    try:
+        current_app.extensions['redis'].delete(trending_cache_key(user_id))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to invalidate trending cache for user {user_id}: {str(e)}")
+
 def generate_presigned_url(file_key, content_type, metadata):
-    """Generate presigned URL with metadata"""
+    """
+    Generate presigned URL with metadata.
+    Signs the PUT request locally with SigV4 (pure HMAC, no S3 client involved).
+    """
     try:
-        s3_client = get_s3_client()
-        bucket_name = os.getenv('AWS_S3_BUCKET')
+        credentials = get_signing_credentials()
+        bucket_name = CFG.AWS_S3_BUCKET
+        region = CFG.AWS_REGION
         
         if not bucket_name:
             raise ValueError("AWS_S3_BUCKET environment variable is not set")
             
-        url = s3_client.generate_presigned_url(
-            'put_object',
-            Params={
-                'Bucket': bucket_name,
-                'Key': file_key,
-                'ContentType': content_type
-            },
-            ExpiresIn=3600
-        )
-        return url
+        # Virtual-hosted style URL, same as the S3 client config above
+        url = f"https://{bucket_name}.s3.{region}.amazonaws.com/{quote(file_key, safe='/~')}"
+        aws_request = AWSRequest(method='PUT', url=url, headers={'Content-Type': content_type})
+        CachedKeyS3SigV4QueryAuth(credentials, 's3', region, expires=3600).add_auth(aws_request)
+        return aws_request.url
         
     except Exception as e:
         logger.error(f"Error generating presigned URL: {str(e)}")
@@ -72,7 +143,7 @@ def store_file_metadata(file_key, metadata):
     try:
         logger.info(f"Storing metadata for file_key: {file_key}")
         s3_client = get_s3_client()
-        bucket_name = os.getenv('AWS_S3_BUCKET')
+        bucket_name = CFG.AWS_S3_BUCKET
         
         if not bucket_name:
             raise ValueError("AWS_S3_BUCKET environment variable is not set")
@@ -84,18 +155,18 @@ def store_file_metadata(file_key, metadata):
         }
         
         metadata_key = f"metadata/{file_key}.json"
-        logger.debug(f"Metadata key: {metadata_key}")
-        logger.debug(f"Metadata content: {json.dumps(metadata_content)}")
+        logger.debug("Metadata key: %s", metadata_key)
+        logger.debug("Metadata content: %s", metadata_content)
         
         response = s3_client.put_object(
             Bucket=bucket_name,
             Key=metadata_key,
-            Body=json.dumps(metadata_content),
+            Body=orjson.dumps(metadata_content),
             ContentType='application/json'
         )
         
         logger.info(f"Stored metadata for file {file_key} in S3 at {metadata_key}")
-        logger.debug(f"S3 put_object response: {response}")
+        logger.debug("S3 put_object response: %s", response)
         
     except ClientError as e:
         logger.error(f"AWS ClientError: {str(e)}")
@@ -104,44 +175,93 @@ def store_file_metadata(file_key, metadata):
         logger.error(f"Unexpected error storing metadata: {str(e)}")
         raise
 
-@clinical_data_bp.route('/get-upload-url', methods=['POST', 'OPTIONS'])
+UPLOAD_REQUIRED_FIELDS = ('filename', 'contentType', 'indicators')
+# Each prepared upload writes metadata that kicks off the Textract pipeline, so cap batch size
+MAX_UPLOADS_PER_BATCH = 25
+
+def prepare_upload(user_id, filename, content_type, indicators):
+    """
+    Presign an upload URL for one file and queue its metadata write.
+    Raises ValueError if the AWS configuration is incomplete.
+    """
+    # Generate metadata
+    metadata = {
+        'indicators': ','.join(indicators),  # Convert list to string
+        'upload_date': datetime.utcnow().isoformat(),
+        'user_id': user_id
+    }
+
+    # Generate a unique file key; ULIDs sort by creation time, so uploads list chronologically
+    file_key = f"uploads/{user_id}/{ULID()}/{filename}"
+
+    upload_url = generate_presigned_url(file_key, content_type, metadata)
+
+    # Build the cached S3 client here on the request thread, so the metadata workers never race
+    # to construct it on first use and each build their own
+    get_s3_client()
+
+    # Persist metadata in the background; store_file_metadata logs its own failures
+    metadata_executor.submit(store_file_metadata, file_key, metadata)
+
+    return {
+        'uploadUrl': upload_url,
+        'fileKey': file_key,
+        'metadata': metadata
+    }
+
+@clinical_data_bp.route('/get-upload-url', methods=['POST'])
 @login_required
 def get_upload_url():
-    if request.method == 'OPTIONS':
-        # CORS preflight request; flask-cors handles this
-        return jsonify({}), 200
-
     try:
         data = request.get_json()
-        if not data or 'filename' not in data or 'contentType' not in data or 'indicators' not in data:
+        if not data or any(field not in data for field in UPLOAD_REQUIRED_FIELDS):
             logger.error("Missing required fields in request")
             return jsonify({'error': 'Missing required fields (filename, contentType, or indicators)'}), 400
 
-        filename = data['filename']
-        content_type = data['contentType']
-        indicators = data['indicators']  # List of selected indicators
-        user_id = session['user']['user_id']
-
-        # Generate metadata
-        metadata = {
-            'indicators': ','.join(indicators),  # Convert list to string
-            'upload_date': datetime.utcnow().isoformat(),
-            'user_id': user_id
-        }
-
-        # Generate a unique file key
-        file_key = f"uploads/{user_id}/{uuid.uuid4()}/{filename}"
+        user_id = g.user['user_id']
 
         try:
-            upload_url = generate_presigned_url(file_key, content_type, metadata)
+            return jsonify(prepare_upload(user_id, data['filename'], data['contentType'], data['indicators']))
 
-            store_file_metadata(file_key, metadata)
+        except ValueError as e:
+            logger.error(f"Configuration error: {str(e)}")
+            return jsonify({'error': 'Server configuration error'}), 500
 
-            return jsonify({
-                'uploadUrl': upload_url,
-                'fileKey': file_key,
-                'metadata': metadata
-            })
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        return jsonify({'error': 'Invalid request'}), 400
+
+@clinical_data_bp.route('/get-upload-urls', methods=['POST'])
+@login_required
+def get_upload_urls():
+    """
+    Presign upload URLs for several files in one call.
+    Expects {"files": [{filename, contentType, indicators}, ...]} and returns
+    {"uploads": [...]} in the same order.
+    """
+    try:
+        data = request.get_json()
+        files = data.get('files') if data else None
+        if not files or not isinstance(files, list):
+            logger.error("Missing files list in request")
+            return jsonify({'error': 'Missing required field (files)'}), 400
+
+        if len(files) > MAX_UPLOADS_PER_BATCH:
+            logger.error(f"Too many files in request: {len(files)}")
+            return jsonify({'error': f'Too many files (maximum {MAX_UPLOADS_PER_BATCH})'}), 400
+
+        if any(not isinstance(f, dict) or any(field not in f for field in UPLOAD_REQUIRED_FIELDS) for f in files):
+            logger.error("Missing required fields in one or more files")
+            return jsonify({'error': 'Missing required fields (filename, contentType, or indicators)'}), 400
+
+        user_id = g.user['user_id']
+
+        try:
+            uploads = [
+                prepare_upload(user_id, f['filename'], f['contentType'], f['indicators'])
+                for f in files
+            ]
+            return jsonify({'uploads': uploads})
 
         except ValueError as e:
             logger.error(f"Configuration error: {str(e)}")
@@ -159,13 +279,14 @@ def confirm_upload():
         if not data or 'fileKey' not in data:
             return jsonify({'error': 'Missing fileKey'}), 400
 
-        user_id = session['user']['user_id']
+        user_id = g.user['user_id']
         file_key = data['fileKey']
         filename = data['filename']
         content_type = data.get('contentType', 'application/octet-stream')
 
         # Here you would typically update your database with the upload information
         logger.info(f"Upload confirmed for user {user_id}, file {filename}")
+        invalidate_trending_cache(user_id)
 
         return jsonify({
             'message': 'Upload confirmed successfully',
@@ -177,36 +298,125 @@ def confirm_upload():
         return jsonify({'error': str(e)}), 500
     
 
+def stream_trending_items(table, query_kwargs, first_page, cache_key, cache_field):
+    """
+    Yield the /trending/all body ({"items": [...]}) one item at a time,
+    following DynamoDB pagination, then cache the complete body in Redis.
+    Chunks are only kept for the cache while the body stays under TRENDING_CACHE_MAX_CHARS;
+    past that they're dropped as soon as they're yielded and the body isn't cached.
+    """
+    dumps = current_app.json.dumps
+    chunks = ['{"items":[']
+    cached_size = len(chunks[0])
+    yield chunks[0]
+
+    response = first_page
+    separator = ''
+    try:
+        while True:
+            for item in response.get('Items', []):
+                chunk = separator + dumps(item)
+                separator = ','
+                if chunks is not None:
+                    cached_size += len(chunk)
+                    if cached_size > TRENDING_CACHE_MAX_CHARS:
+                        chunks = None  # Too big to cache; stop holding on to the body
+                    else:
+                        chunks.append(chunk)
+                yield chunk
+
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                break
+            response = table.query(ExclusiveStartKey=last_key, **query_kwargs)
+    except Exception as e:
+        # Headers are already sent, so all we can do is log and cut the stream
+        logger.error(f"Error streaming trending data: {str(e)}")
+        raise
+
+    yield ']}'
+
+    if chunks is None:
+        return
+
+    chunks.append(']}')
+    try:
+        pipe = current_app.extensions['redis'].pipeline()
+        pipe.hset(cache_key, cache_field, ''.join(chunks))
+        pipe.expire(cache_key, TRENDING_CACHE_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Trending cache write failed: {str(e)}")
+
 @clinical_data_bp.route("/trending/all", methods=["GET"])
 @login_required
 def get_all_trending_data():
     logger.info("GET /clinical-data/trending/all called")
-    if request.method == 'OPTIONS':
-        # Handle CORS preflight request
-        response = jsonify({})
-        response.status_code = 200
-        response.headers.add("Access-Control-Allow-Origin", "http://localhost:3030")
-        response.headers.add("Access-Control-Allow-Methods", "GET, OPTIONS")
-        response.headers.add("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        return response
+
+    # ?fields=a,b,c selects attributes; "all" returns whole items
+    fields_param = request.args.get('fields')
+    if fields_param == 'all':
+        fields = ()
+    elif fields_param:
+        fields = tuple(sorted(set(f.strip() for f in fields_param.split(',') if f.strip())))
+        unknown_fields = [f for f in fields if f not in TRENDING_FIELDS]
+        if unknown_fields:
+            return jsonify({'error': f"Unknown fields: {', '.join(unknown_fields)}"}), 400
+    else:
+        fields = DEFAULT_TRENDING_FIELDS
 
     try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('clinical_reports')
+        table = get_clinical_reports_table()
         
-        user_id = session['user']['user_id']    
+        user_id = g.user['user_id']    
+        redis_client = current_app.extensions['redis']
+        # One hash per user, one entry per field selection, so invalidation is a single delete
+        cache_key = trending_cache_key(user_id)
+        cache_field = ','.join(fields) or 'all'
 
-        response = table.query(
-            KeyConditionExpression=Key("UserId").eq(user_id)
+        try:
+            cached = redis_client.hget(cache_key, cache_field)
+        except redis.RedisError as e:
+            logger.warning(f"Trending cache read failed: {str(e)}")
+            cached = None
+
+        if cached is not None:
+            return current_app.response_class(cached, mimetype='application/json')
+
+        query_kwargs = {'KeyConditionExpression': Key("UserId").eq(user_id)}
+        if fields:
+            # Alias every attribute: names contain '#' and some (e.g. Result) are reserved
+            aliases = {f"#f{i}": field for i, field in enumerate(fields)}
+            query_kwargs['ProjectionExpression'] = ', '.join(aliases)
+            query_kwargs['ExpressionAttributeNames'] = aliases
+
+        # Fetch the first page here so query errors still turn into a 500,
+        # then stream items (and any further pages) as they are encoded
+        response = table.query(**query_kwargs)
+        return current_app.response_class(
+            stream_with_context(stream_trending_items(table, query_kwargs, response, cache_key, cache_field)),
+            mimetype='application/json'
         )
-        # Return items in a JSON structure
-        return jsonify({"items": response.get("Items", [])})
     except Exception as e:
         logger.error(f"Error getting all trending data: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+LATEST_UPLOAD_INDEX = 'UserId-UploadDate-index'
+
 ALLOWED_UPDATE_FIELDS = ['PatientName', 'CollectedDate', 'Result', 'Units', 'LowerRange', 'UpperRange']
 
+# DynamoDB reserved keywords that need an expression attribute name alias
+DYNAMODB_RESERVED_KEYWORDS = frozenset([
+    'size', 'date', 'name', 'value', 'key', 'type', 'order', 'group', 'Result'
+])
+
+# field -> (SET fragment, name alias or None, value placeholder), built once
+UPDATE_TEMPLATES = {
+    field: (f"#{field} = :{field}", f"#{field}", f":{field}") if field in DYNAMODB_RESERVED_KEYWORDS
+    else (f"{field} = :{field}", None, f":{field}")
+    for field in ALLOWED_UPDATE_FIELDS
+}
+
 @clinical_data_bp.route('/<string:data_id>', methods=['GET'])
 @login_required
 def get_clinical_data(data_id):
@@ -214,10 +424,9 @@ def get_clinical_data(data_id):
     Retrieve a specific clinical data entry by its ID.
     """
     try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('clinical_reports')
+        table = get_clinical_reports_table()
 
-        user_id = session['user']['user_id']
+        user_id = g.user['user_id']
 
         response = table.get_item(
             Key={
@@ -253,61 +462,52 @@ def update_clinical_data(data_id):
             return jsonify({'error': 'No data provided'}), 400
 
         # Filter data to only include allowed fields with correct casing
-        update_fields = {key: value for key, value in data.items() if key in ALLOWED_UPDATE_FIELDS}
+        update_fields = {key: value for key, value in data.items() if key in UPDATE_TEMPLATES}
 
         if not update_fields:
             logger.error("No valid fields provided for update.")
             return jsonify({'error': 'No valid fields provided for update'}), 400
 
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('clinical_reports')
+        table = get_clinical_reports_table()
 
-        user_id = session['user']['user_id']
+        user_id = g.user['user_id']
 
         # Initialize dictionaries for expression attribute names and values
         expression_attribute_names = {}
         expression_attribute_values = {}
 
-        # Updated reserved keywords list (removed 'result' if it was previously included)
-        dynamodb_reserved_keywords = [
-            'size', 'date', 'name', 'value', 'key', 'type', 'order', 'group',
-            # Add 'Result' if it's confirmed to be reserved
-            'Result'
-        ]
-
         update_expression_parts = []
         for field, value in update_fields.items():
-            # Check if the field is a reserved keyword
-            if field in dynamodb_reserved_keywords:
-                alias = f"#{field}"
+            fragment, alias, placeholder = UPDATE_TEMPLATES[field]
+            if alias:
                 expression_attribute_names[alias] = field
-                update_expression_parts.append(f"{alias} = :{field}")
-            else:
-                update_expression_parts.append(f"{field} = :{field}")
-
-            # Add only one entry to ExpressionAttributeValues
-            expression_attribute_values[f":{field}"] = value
+            update_expression_parts.append(fragment)
+            expression_attribute_values[placeholder] = value
 
         update_expression = "SET " + ", ".join(update_expression_parts)
 
         # Debugging logs to verify expressions
-        logger.debug(f"UpdateExpression: {update_expression}")
-        logger.debug(f"ExpressionAttributeNames: {expression_attribute_names}")
-        logger.debug(f"ExpressionAttributeValues: {expression_attribute_values}")
-
-        # Perform the update operation
+        logger.debug("UpdateExpression: %s", update_expression)
+        logger.debug("ExpressionAttributeNames: %s", expression_attribute_names)
+        logger.debug("ExpressionAttributeValues: %s", expression_attribute_values)
+
+        # Perform the update operation; boto3 rejects an explicit None for the names map
+        update_kwargs = {}
+        if expression_attribute_names:
+            update_kwargs['ExpressionAttributeNames'] = expression_attribute_names
         response = table.update_item(
             Key={
                 'UserId': user_id,
                 'PatientId#TestDateTime#Indicator': data_id
             },
             UpdateExpression=update_expression,
-            ExpressionAttributeNames=expression_attribute_names or None,
             ExpressionAttributeValues=expression_attribute_values,
-            ReturnValues="UPDATED_NEW"
+            ReturnValues="UPDATED_NEW",
+            **update_kwargs
         )
 
         logger.info(f"Updated clinical data {data_id} for user {user_id}: {response.get('Attributes')}")
+        invalidate_trending_cache(user_id)
 
         return jsonify({
             'message': 'Data updated successfully',
@@ -325,40 +525,22 @@ def update_clinical_data(data_id):
 @login_required
 def get_latest_upload():
     try:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('clinical_reports')
+        table = get_clinical_reports_table()
         
-        user_id = session['user']['user_id']
+        user_id = g.user['user_id']
         
+        # The GSI is sorted by the ISO-8601 UploadDate, so the first item in
+        # descending order is the latest upload
         response = table.query(
+            IndexName=LATEST_UPLOAD_INDEX,
             KeyConditionExpression=Key('UserId').eq(user_id),
             ScanIndexForward=False,  # Descending order
-            Limit=10  # Fetch top 10 to increase the chance of getting the latest
+            Limit=1
         )
         
         items = response.get('Items', [])
-        latest_entry = None
-        latest_datetime = None
-        
-        for item in items:
-            sort_key = item.get('PatientId#TestDateTime#Indicator', '')
-            
-            if sort_key.count('#') != 2:
-                logger.error(f"Malformed sort_key '{sort_key}': Expected 3 parts separated by '#'")
-                continue
-            try:
-                _, test_datetime_str, _ = sort_key.split('#')
-                test_datetime = datetime.fromisoformat(test_datetime_str)
-                
-                if not latest_datetime or test_datetime > latest_datetime:
-                    latest_datetime = test_datetime
-                    latest_entry = item
-            except ValueError:
-                logger.error(f"Error parsing datetime from sort_key '{sort_key}': {e}")
-                continue  # Skip items with improperly formatted sort keys
-        
-        if latest_entry:
-            return jsonify(latest_entry), 200
+        if items:
+            return jsonify(items[0]), 200
         else:
             return jsonify({'error': 'No valid data found'}), 404
     
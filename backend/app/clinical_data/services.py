@@ -1,62 +1,49 @@
 import boto3
-import os
 from datetime import datetime, UTC, timedelta
 from botocore.exceptions import ClientError
-from dotenv import load_dotenv
-import tempfile
-
-load_dotenv()
+from app.config import CFG
 
 class S3Service:
     def __init__(self):
         self.s3_client = boto3.client(
             's3',
-            aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-            aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-            region_name=os.getenv('AWS_REGION')
+            aws_access_key_id=CFG.AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=CFG.AWS_SECRET_ACCESS_KEY,
+            region_name=CFG.AWS_REGION
         )
-        self.bucket_name = os.getenv('AWS_S3_BUCKET')
+        self.bucket_name = CFG.AWS_S3_BUCKET
 
     def upload_file(self, file, user_id, indicators=None, cognito_token=None):
         """
         Uploads a file to S3 with user ID, indicators, and Cognito token embedded in the metadata.
+        The request stream is handed straight to boto3, which chunks large files itself.
         """
-        temp_file = None
         try:
-            # Create a temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False)
-            file.save(temp_file.name)
-            
             # Generate file key
             timestamp = datetime.now(UTC).strftime('%Y%m%d%H%M%S')
             file_key = f"uploads/{user_id}/{timestamp}_{file.filename}"
             
-            # Prepare upload parameters with metadata
-            upload_args = {
-                'Bucket': self.bucket_name,
-                'Key': file_key,
-                'Body': open(temp_file.name, 'rb'),
-                'ContentType': file.content_type,
-                'Metadata': {
-                    'UserId': user_id,
-                    'UploadDate': timestamp,
-                    'Indicators': ','.join(indicators) if indicators else '',
-                    'CognitoToken': cognito_token if cognito_token else ''
+            # Upload to S3 with metadata
+            self.s3_client.upload_fileobj(
+                file.stream,
+                self.bucket_name,
+                file_key,
+                ExtraArgs={
+                    'ContentType': file.content_type,
+                    'Metadata': {
+                        'UserId': user_id,
+                        'UploadDate': timestamp,
+                        'Indicators': ','.join(indicators) if indicators else '',
+                        'CognitoToken': cognito_token if cognito_token else ''
+                    }
                 }
-            }
-            
-            # Upload to S3
-            self.s3_client.upload_fileobj(**upload_args)
+            )
             
             return file_key
 
         except Exception as e:
             print(f"Error uploading file: {str(e)}")
             raise
-        finally:
-            if temp_file:
-                temp_file.close()
-                os.unlink(temp_file.name)
 
     def generate_presigned_url(self, file_key, expiration=3600):
         """
@@ -81,21 +68,32 @@ class S3Service:
         Cleanup files older than specified days
         """
         try:
-            # Calculate cutoff date
-            cutoff_date = datetime.now(UTC) - timedelta(days=days_old)
+            # Calculate cutoff once as a plain timestamp
+            cutoff_ts = (datetime.now(UTC) - timedelta(days=days_old)).timestamp()
             
             # List objects in user's folder
             paginator = self.s3_client.get_paginator('list_objects_v2')
             prefix = f"uploads/{user_id}/"
             
             for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
-                for obj in page.get('Contents', []):
-                    if obj['LastModified'].replace(tzinfo=UTC) < cutoff_date:
-                        self.s3_client.delete_object(
-                            Bucket=self.bucket_name,
-                            Key=obj['Key']
-                        )
-                        print(f"Deleted old file: {obj['Key']}")
+                # A page holds at most 1000 keys, which is also the DeleteObjects limit
+                stale_keys = [
+                    obj['Key'] for obj in page.get('Contents', [])
+                    if obj['LastModified'].timestamp() < cutoff_ts
+                ]
+                if not stale_keys:
+                    continue
+
+                response = self.s3_client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={
+                        'Objects': [{'Key': key} for key in stale_keys],
+                        'Quiet': True
+                    }
+                )
+                for error in response.get('Errors', []):
+                    print(f"Failed to delete old file {error['Key']}: {error.get('Message')}")
+                print(f"Deleted {len(stale_keys) - len(response.get('Errors', []))} old files under {prefix}")
                         
         except Exception as e:
             print(f"Error in cleanup: {str(e)}")
@@ -0,0 +1,41 @@
+import os
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+# Load environment variables once for the whole app
+load_dotenv()
+
+@dataclass(frozen=True)
+class Config:
+    """Snapshot of the environment variables the backend reads, taken at startup"""
+    FLASK_SECRET_KEY: str
+    REDIS_URL: str
+    CLIENT_ID: str
+    CLIENT_SECRET: str
+    COGNITO_IDP_DOMAIN: str
+    USER_POOL_ID: str
+    COGNITO_LOGOUT_URL: str
+    COGNITO_REDIRECT_URL: str
+    AWS_ACCESS_KEY_ID: str
+    AWS_SECRET_ACCESS_KEY: str
+    AWS_REGION: str
+    AWS_S3_BUCKET: str
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            FLASK_SECRET_KEY=os.getenv('FLASK_SECRET_KEY', os.urandom(24).hex()),
+            REDIS_URL=os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            CLIENT_ID=os.getenv('CLIENT_ID'),
+            CLIENT_SECRET=os.getenv('CLIENT_SECRET'),
+            COGNITO_IDP_DOMAIN=os.getenv('COGNITO_IDP_DOMAIN'),
+            USER_POOL_ID=os.getenv('USER_POOL_ID'),
+            COGNITO_LOGOUT_URL=os.getenv('COGNITO_LOGOUT_URL'),
+            COGNITO_REDIRECT_URL=os.getenv('COGNITO_REDIRECT_URL'),
+            AWS_ACCESS_KEY_ID=os.getenv('AWS_ACCESS_KEY_ID'),
+            AWS_SECRET_ACCESS_KEY=os.getenv('AWS_SECRET_ACCESS_KEY'),
+            AWS_REGION=os.getenv('AWS_REGION'),
+            AWS_S3_BUCKET=os.getenv('AWS_S3_BUCKET')
+        )
+
+CFG = Config.from_env()
@@ -0,0 +1,26 @@
+from decimal import Decimal
+from flask.json.provider import DefaultJSONProvider
+import orjson
+
+def _ddb_default(o):
+    """Serialize DynamoDB Decimals as JSON numbers, defer anything else to Flask"""
+    if isinstance(o, Decimal):
+        # orjson only encodes ints that fit in 64 bits; larger whole numbers fall back to float like fractions do
+        if o == o.to_integral_value() and -2**63 <= o < 2**64:
+            return int(o)
+        return float(o)
+    return DefaultJSONProvider.default(o)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson"""
+
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_ddb_default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
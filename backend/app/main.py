@@ -1,24 +1,35 @@
 import logging
 from flask import Flask
 from flask_cors import CORS
+from flask_session import Session
 from datetime import timedelta
-import os
-from dotenv import load_dotenv
+import redis
+from app.config import CFG
+from app.json_provider import OrjsonProvider
 
 def create_app():
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
     
-    # Load environment variables early
-    load_dotenv()
-    
-    # Session configuration
+    # Session configuration (server-side, stored in Redis)
+    redis_client = redis.Redis.from_url(CFG.REDIS_URL)
     app.config.update(
-        SECRET_KEY=os.getenv('FLASK_SECRET_KEY', os.urandom(24).hex()),
+        SECRET_KEY=CFG.FLASK_SECRET_KEY,
+        SESSION_TYPE='redis',
+        SESSION_REDIS=redis_client,
+        SESSION_USE_SIGNER=True,
+        SESSION_PERMANENT=True,
         SESSION_COOKIE_SECURE=False,
         SESSION_COOKIE_HTTPONLY=True,
         SESSION_COOKIE_SAMESITE='Lax',
-        PERMANENT_SESSION_LIFETIME=timedelta(hours=1)
+        # Also used as the Redis key TTL, so expired sessions disappear on their own
+        PERMANENT_SESSION_LIFETIME=timedelta(hours=1),
+        # Only re-store (and so re-arm the TTL) when the session changes, keeping the one-hour
+        # lifetime from login absolute instead of sliding with every request
+        SESSION_REFRESH_EACH_REQUEST=False
     )
+    Session(app)
+    app.extensions['redis'] = redis_client
     
     # Configure Logging
     logging.basicConfig(
@@ -1,119 +1,177 @@
 import json
+import orjson
 import boto3
+from boto3.s3.transfer import TransferConfig
 import logging
+import io
+import gzip
 import os
+import re
 import urllib.parse
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Shared client config: enough pooled keep-alive connections for the concurrent workers,
+# and adaptive retries so Textract throttling backs off instead of piling on retries
+_cfg = Config(
+    max_pool_connections=64,
+    retries={'mode': 'adaptive', 'max_attempts': 10},
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=15
+)
+
 # Initialize AWS clients
-s3_client = boto3.client('s3')
-textract_client = boto3.client('textract')
-sns_client = boto3.client('sns')
+s3_client = boto3.client('s3', config=_cfg)
+textract_client = boto3.client('textract', config=_cfg)
+sns_client = boto3.client('sns', config=_cfg)
+lambda_client = boto3.client('lambda', config=_cfg)
+
+# Large result objects are uploaded as parallel multipart parts; small ones still go up in a single PUT
+_XFER = TransferConfig(
+    multipart_threshold=8 << 20,
+    multipart_chunksize=8 << 20,
+    max_concurrency=8,
+    use_threads=True
+)
+
+# Worker pool kept across warm invocations: per-record tasks in lambda_handler, and the
+# one-page-ahead Textract prefetch in result_lambda_handler (a separate function, so the two never share it)
+executor = ThreadPoolExecutor(max_workers=10)
+
+# Environment variables, validated at import so a misconfigured function fails fast with a KeyError:
+# destination bucket for Textract results, SNS topic ARN for Textract notifications, IAM role ARN for Textract
+RESULT_BUCKET, SNS_TOPIC_ARN, ROLE_ARN = (os.environ[k] for k in ("RESULT_BUCKET", "SNS_TOPIC_ARN", "ROLE_ARN"))
+RESULT_FN = os.environ.get('RESULT_FN')              # Function that fetches and saves Textract results (result_lambda_handler)
+
+# Textract job completion notifications go to the same topic and role for every job
+NOTIFICATION_CHANNEL = {"SNSTopicArn": SNS_TOPIC_ARN, "RoleArn": ROLE_ARN}
 
-# Environment variables
-RESULT_BUCKET = os.environ.get('RESULT_BUCKET')      # Destination bucket for Textract results
-SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')      # SNS topic ARN for Textract notifications
-ROLE_ARN = os.environ.get('ROLE_ARN')                # IAM role ARN for Textract
+# metadata/uploads/<user_id>/<unique_id>/<filename_base>.<ext>.json
+_KEY_RE = re.compile(r'^metadata/uploads/([^/]+)/([^/]+)/(.+)\.(jpg|jpeg|png|pdf)\.json$', re.IGNORECASE)
 
-# Validate environment variables
-if not RESULT_BUCKET or not SNS_TOPIC_ARN or not ROLE_ARN:
-    logger.error("One or more required environment variables (RESULT_BUCKET, SNS_TOPIC_ARN, ROLE_ARN) are missing.")
-    raise ValueError("Missing required environment variables.")
+class NonRetryableError(ValueError):
+    """Raised for messages that can never succeed, so they are logged and dropped instead of redelivered"""
 
 def lambda_handler(event, context):
     """
     Lambda function to process SQS messages from S3 Event Notifications and Textract notifications.
+    Every S3 record across the batch is an independent, I/O-bound task, so they all run concurrently.
+    Failed records are reported back as a partial batch failure, so SQS only redelivers those.
     """
-    logger.info(f"Received event: {json.dumps(event)}")
-    
-    for sqs_record in event.get('Records', []):
-        try:
-            message_body = json.loads(sqs_record.get('body', '{}'))
-            
-            # Flag to determine if the message has been processed
-            processed = False
-            
-            # Check if the message is an S3 Event Notification
-            if 'Records' in message_body:
-                for record in message_body['Records']:
-                    if record.get('eventSource') == 'aws:s3':
-                        logger.info("Handling S3 Event Notification.")
-                        handle_s3_event(record)
-                        processed = True
-                        break  # Assuming each message contains only one relevant record
-            
-            # If not processed yet, check if it's a Textract Job Notification
-            if not processed:
-                if 'JobId' in message_body and 'Status' in message_body:
-                    logger.info("Handling Textract Job Notification.")
-                    handle_textract_notification(message_body)
-                    processed = True
-            
-            if not processed:
-                logger.warning("Unknown message format. Skipping.")
-        
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error for record {sqs_record}: {e}")
-        except Exception as e:
-            logger.error(f"Error processing record {sqs_record}: {e}")
-            # Optionally, handle the exception (e.g., move message to a dead-letter queue)
-            continue
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Received event: %s", orjson.dumps(event).decode())
+
+    tasks = [task for sqs_record in event.get('Records', []) for task in parse_record(sqs_record)]
+    # A message fails if any of its tasks failed; dict.fromkeys dedupes while keeping batch order
+    failures = dict.fromkeys(message_id for message_id in executor.map(process_task, tasks) if message_id)
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
+
+def parse_record(sqs_record):
+    """
+    Parses a single SQS record into (messageId, handler, payload) tasks.
+    An S3 Event Notification yields one task per S3 record in the message.
+    Messages that can't be parsed or have an unexpected shape are logged and dropped,
+    so one bad message never fails the rest of the batch.
+    """
+    message_id = sqs_record.get('messageId')
+    try:
+        message_body = orjson.loads(sqs_record.get('body', '{}'))
+
+        if not isinstance(message_body, dict):
+            logger.warning("Unknown message format. Skipping.")
+            return []
+
+        # Dispatch on message shape: S3 Event Notification or Textract Job Notification
+        records = message_body.get('Records')
+        if isinstance(records, list):
+            s3_records = [record for record in records if isinstance(record, dict) and record.get('eventSource') == 'aws:s3']
+            if s3_records:
+                logger.info("Handling S3 Event Notification with %s record(s).", len(s3_records))
+                return [(message_id, handle_s3_event, record) for record in s3_records]
+        if 'JobId' in message_body and 'Status' in message_body:
+            logger.info("Handling Textract Job Notification.")
+            return [(message_id, handle_textract_notification, message_body)]
+
+        logger.warning("Unknown message format. Skipping.")
+        return []
+
+    except orjson.JSONDecodeError as e:
+        # A malformed body will never parse, so don't ask SQS to redeliver it
+        logger.error("JSON decode error for record %s: %s", sqs_record, e)
+    except Exception as e:
+        # An unexpected shape won't change on redelivery either
+        logger.error("Error parsing record %s: %s", sqs_record, e)
+    return []
+
+def process_task(task):
+    """
+    Runs a single task. Errors are logged so one bad record doesn't affect the others.
+    Returns the owning message's messageId if it should be retried, otherwise None.
+    """
+    message_id, handler, payload = task
+    try:
+        handler(payload)
+    except NonRetryableError as e:
+        # Redelivery can't fix this, and would re-run the message's other, already successful records
+        logger.error("Dropping message %s: %s", message_id, e)
+    except Exception as e:
+        logger.error("Error processing message %s: %s", message_id, e)
+        # Let SQS redeliver just this message (and eventually move it to the dead-letter queue)
+        return message_id
+    return None
 
 def handle_s3_event(s3_record):
     """
     Processes S3 Event Notifications and initiates Textract jobs.
     """
-    s3_bucket = s3_record['s3']['bucket']['name']
-    s3_key = urllib.parse.unquote_plus(s3_record['s3']['object']['key'])
+    try:
+        s3_bucket = s3_record['s3']['bucket']['name']
+        s3_key = urllib.parse.unquote_plus(s3_record['s3']['object']['key'])
+    except (KeyError, TypeError) as e:
+        raise NonRetryableError(f"Malformed S3 event record: {e}") from e
 
-    logger.info(f"Processing S3 object: s3://{s3_bucket}/{s3_key}")
+    logger.info("Processing S3 object: s3://%s/%s", s3_bucket, s3_key)
 
-    # Extract user_id, unique_id, and filename from the key
+    # Extract user_id, unique_id, filename base and extension from the key in one match
     try:
-        key_parts = s3_key.split('/')
-        if len(key_parts) < 5:
-            raise ValueError("Invalid key structure. Expected format: metadata/uploads/<user_id>/<unique_id>/<filename>")
-        
-        user_id = key_parts[2]         # 'c129000e-30b1-702e-33ae-eec0ec14be40'
-        unique_id = key_parts[3]       # '948c83b7-426f-4e9c-821e-ba0efec45db8'
-        filename = key_parts[4]        # 'report_2.jpg.json'
-
-        # Derive main file key (include 'uploads/' prefix and remove '.json' suffix)
-        main_file_key = derive_main_file_key(s3_key)  # 'uploads/c129000e-30b1-702e-33ae-eec0ec14be40/948c83b7-426f-4e9c-821e-ba0efec45db8/report_2.jpg'
-        logger.info(f"Derived main_file_key: {main_file_key}")
-
-        # Ensure the main_file_key is in the correct format
-        if not main_file_key.endswith(('.jpg', '.jpeg', '.png', '.pdf')):
-            raise ValueError(f"Unsupported file type for Textract: {main_file_key}")
+        m = _KEY_RE.match(s3_key)
+        if not m:
+            raise NonRetryableError(f"Invalid key structure or unsupported file type for Textract: {s3_key}. Expected format: metadata/uploads/<user_id>/<unique_id>/<filename>.(jpg|jpeg|png|pdf).json")
+
+        user_id, unique_id, filename_base, ext = m.groups()
+
+        # Main file key (include 'uploads/' prefix and remove '.json' suffix)
+        main_file_key = f"uploads/{user_id}/{unique_id}/{filename_base}.{ext}"  # 'uploads/c129000e-30b1-702e-33ae-eec0ec14be40/948c83b7-426f-4e9c-821e-ba0efec45db8/report_2.jpg'
+        logger.info("Derived main_file_key: %s", main_file_key)
 
         # Prepare the result prefix to avoid duplicate 'uploads/'
-        original_filename = os.path.splitext(os.path.basename(main_file_key))[0]  # 'report_2'
-        result_prefix = construct_result_key(main_file_key)
-        logger.info(f"Constructed result_prefix: {result_prefix}")
+        result_prefix = f"textract-results/uploads/{user_id}/{unique_id}/{filename_base}_textract.json"
+        logger.info("Constructed result_prefix: %s", result_prefix)
 
         # Start Textract job with NotificationChannel and OutputConfig
         response = textract_client.start_document_analysis(
             DocumentLocation={'S3Object': {'Bucket': s3_bucket, 'Name': main_file_key}},
             FeatureTypes=['FORMS', 'TABLES'],  # Customize as needed
-            NotificationChannel={
-                "SNSTopicArn": SNS_TOPIC_ARN,
-                "RoleArn": ROLE_ARN
-            },
+            NotificationChannel=NOTIFICATION_CHANNEL,
             OutputConfig={
                 'S3Bucket': RESULT_BUCKET,
                 'S3Prefix': result_prefix
-            }
+            },
+            JobTag=unique_id,             # Echoed back in the completion notification
+            ClientRequestToken=unique_id  # Redelivered messages get the existing job instead of a new one
         )
         job_id = response['JobId']
-        logger.info(f"Textract job started successfully with ID: {job_id}, results will be saved under: s3://{RESULT_BUCKET}/{result_prefix}")
+        logger.info("Textract job started successfully with ID: %s, results will be saved under: s3://%s/%s", job_id, RESULT_BUCKET, result_prefix)
 
     except Exception as e:
-        logger.error(f"Error processing S3 object: {e}")
+        logger.error("Error processing S3 object: %s", e)
         raise
 
 def derive_main_file_key(metadata_key):
@@ -126,22 +184,21 @@ def derive_main_file_key(metadata_key):
     expected_prefix = 'metadata/uploads/'
     expected_suffix = '.json'
 
-    if not metadata_key.startswith(expected_prefix) or not metadata_key.endswith(expected_suffix):
-        raise ValueError(f"Invalid metadata key format: {metadata_key}")
+    if not isinstance(metadata_key, str) or not metadata_key.startswith(expected_prefix) or not metadata_key.endswith(expected_suffix):
+        raise NonRetryableError(f"Invalid metadata key format: {metadata_key}")
 
     # Strip the 'metadata/uploads/' prefix and '.json' suffix, then prepend 'uploads/'
     main_file_key = 'uploads/' + metadata_key[len(expected_prefix):-len(expected_suffix)]
-    logger.info(f"Derived main_file_key: {main_file_key}")
     return main_file_key
 
-def construct_result_key(main_file_key, suffix='_textract.json'):
+def construct_result_key(main_file_key, suffix='_textract.json.gz'):
     """
     Constructs the S3 key for the result files by replacing the prefix and adding a suffix.
     Example:
-        uploads/user_id/unique_id/report_1.jpg -> textract-results/uploads/user_id/unique_id/report_1_textract.json
+        uploads/user_id/unique_id/report_1.jpg -> textract-results/uploads/user_id/unique_id/report_1_textract.json.gz
     """
     if not main_file_key.startswith('uploads/'):
-        raise ValueError(f"Invalid main file key format: {main_file_key}")
+        raise NonRetryableError(f"Invalid main file key format: {main_file_key}")
 
     # Replace 'uploads/' with 'textract-results/uploads/' and add suffix before the file extension
     parts = main_file_key.split('/')
@@ -149,79 +206,109 @@ def construct_result_key(main_file_key, suffix='_textract.json'):
     filename_base, _ = os.path.splitext(filename)
     new_filename = f"{filename_base}{suffix}"
     result_key = '/'.join(['textract-results/uploads'] + parts[1:-1] + [new_filename])
-    logger.info(f"Constructed result_key: {result_key}")
     return result_key
 
 def handle_textract_notification(message_body):
     """
-    Handles Textract job completion notifications and saves results to S3.
+    Handles Textract job completion notifications.
+    Fetching and saving the results is handed to a separate asynchronous invocation
+    (result_lambda_handler), so this invocation returns without waiting on Textract.
     """
     job_id = message_body.get('JobId')
     status = message_body.get('Status', 'FAILED')
-    metadata_key = message_body.get('MetadataKey')  # Ensure this is passed correctly
 
-    logger.info(f"Textract Job ID: {job_id}, Status: {status}")
+    logger.info("Textract Job ID: %s, Status: %s", job_id, status)
 
     if status != 'SUCCEEDED':
-        logger.error(f"Textract job {job_id} failed or did not succeed. Status: {status}")
-        raise ValueError(f"Textract job {job_id} failed or did not succeed. Status: {status}")
+        logger.error("Textract job %s failed or did not succeed. Status: %s", job_id, status)
+        raise NonRetryableError(f"Textract job {job_id} failed or did not succeed. Status: {status}")
 
-    try:
-        # Derive main_file_key from metadata_key
-        main_file_key = derive_main_file_key(metadata_key)
-        logger.info(f"Derived main_file_key from metadata: {main_file_key}")
+    if not RESULT_FN:
+        logger.error("Environment variable 'RESULT_FN' is not set.")
+        raise ValueError("Missing 'RESULT_FN' environment variable.")
 
-        # Fetch Textract results
-        textract_result = get_textract_results(job_id)
-        logger.info(f"Textract job {job_id} results retrieved successfully.")
-    except Exception as e:
-        logger.error(f"Failed to retrieve Textract results for Job ID {job_id}: {e}")
-        raise
+    # Textract reports the analysed document in the notification, so there's nothing to re-derive;
+    # fall back to the metadata key for notifications that don't carry it
+    main_file_key = message_body.get('DocumentLocation', {}).get('S3ObjectName')
+    if not main_file_key:
+        main_file_key = derive_main_file_key(message_body.get('MetadataKey'))
+    result_key = construct_result_key(main_file_key)
 
-    try:
-        # Construct the result key
-        result_key = construct_result_key(main_file_key)
-        logger.info(f"Constructed result key: s3://{RESULT_BUCKET}/{result_key}")
+    lambda_client.invoke(
+        FunctionName=RESULT_FN,
+        InvocationType='Event',
+        Payload=json.dumps({'JobId': job_id, 'ResultKey': result_key})
+    )
+    logger.info("Dispatched result retrieval for Textract job %s to %s", job_id, RESULT_FN)
 
-        # Save results to S3
-        save_textract_to_s3(textract_result, RESULT_BUCKET, result_key)
-        logger.info(f"Textract results saved to s3://{RESULT_BUCKET}/{result_key}")
+def result_lambda_handler(event, context):
+    """
+    Lambda function invoked asynchronously by handle_textract_notification.
+    Fetches the Textract results for a finished job and saves them to S3.
+    """
+    job_id = event['JobId']
+    result_key = event['ResultKey']
+    logger.info("Saving Textract results for Job ID %s to s3://%s/%s", job_id, RESULT_BUCKET, result_key)
+
+    try:
+        # Stream result pages straight into the S3 object as they arrive
+        save_textract_to_s3(iter_textract_pages(job_id), RESULT_BUCKET, result_key)
     except Exception as e:
-        logger.error(f"Failed to save Textract results to S3 for Job ID {job_id}: {e}")
+        logger.error("Failed to retrieve or save Textract results for Job ID %s: %s", job_id, e)
         raise
 
-def get_textract_results(job_id):
+def iter_textract_pages(job_id):
     """
-    Retrieves Textract job results.
+    Yields Textract job results one page (list of blocks) at a time.
+    The request for the next page is issued before the current page is yielded,
+    so its round-trip overlaps with the caller serializing the current page.
     """
     try:
         response = textract_client.get_document_analysis(JobId=job_id)
-        blocks = response.get('Blocks', [])
-        
-        # Handle pagination if necessary
-        next_token = response.get('NextToken')
-        while next_token:
-            paginated_response = textract_client.get_document_analysis(JobId=job_id, NextToken=next_token)
-            blocks.extend(paginated_response.get('Blocks', []))
-            next_token = paginated_response.get('NextToken')
-        
-        return blocks
+        while True:
+            # Each page depends on the previous NextToken, so one page ahead is the most we can prefetch
+            next_token = response.get('NextToken')
+            next_page = executor.submit(
+                textract_client.get_document_analysis, JobId=job_id, NextToken=next_token
+            ) if next_token else None
+
+            yield response.get('Blocks', [])
+
+            if next_page is None:
+                return
+            response = next_page.result()
     except ClientError as e:
-        logger.error(f"Error fetching Textract results for Job ID {job_id}: {e}")
+        logger.error("Error fetching Textract results for Job ID %s: %s", job_id, e)
         raise
 
-def save_textract_to_s3(textract_result, bucket, key):
+def save_textract_to_s3(pages, bucket, key):
     """
-    Saves Textract results to the specified S3 bucket and key.
+    Saves Textract results to the specified S3 bucket and key as one gzip-compressed JSON array of blocks.
+    Pages are serialized and compressed into the buffer as they arrive instead of building one big list first.
     """
     try:
-        s3_client.put_object(
-            Body=json.dumps(textract_result),
-            Bucket=bucket,
-            Key=key,
-            ContentType='application/json'
+        buffer = io.BytesIO()
+        # Block arrays are highly repetitive; level 3 gets most of the ratio without being CPU-bound
+        with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=3) as gz:
+            gz.write(b'[')
+            separator = b''
+            for blocks in pages:
+                if not blocks:
+                    continue
+                # Strip the page's own brackets and splice it into the array
+                gz.write(separator + orjson.dumps(blocks)[1:-1])
+                separator = b','
+            gz.write(b']')
+
+        buffer.seek(0)
+        s3_client.upload_fileobj(
+            buffer,
+            bucket,
+            key,
+            ExtraArgs={'ContentType': 'application/json', 'ContentEncoding': 'gzip'},
+            Config=_XFER
         )
-        logger.info(f"Successfully saved Textract results to s3://{bucket}/{key}")
+        logger.info("Successfully saved Textract results to s3://%s/%s", bucket, key)
     except ClientError as e:
-        logger.error(f"Error saving Textract results to S3: {e}")
-        raise
\ No newline at end of file
+        logger.error("Error saving Textract results to S3: %s", e)
+        raise
@@ -1,14 +1,15 @@
 import json
+import orjson
+import ijson
 import boto3
 import logging
 import os
 import re
 import hashlib
 from decimal import Decimal, InvalidOperation
-from fuzzywuzzy import process
-from botocore.exceptions import ClientError
-import time
-import functools
+from rapidfuzz import process, fuzz, utils
+from botocore.exceptions import ClientError, BotoCoreError
+from concurrent.futures import ThreadPoolExecutor
 from botocore.config import Config
 
 # Configure structured logging
@@ -31,11 +32,11 @@ formatter = JsonFormatter()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
-# AWS SDK retry configuration
+# AWS SDK retry configuration; adaptive mode also rate-limits the client while it is being throttled
 aws_config = Config(
     retries={
         'max_attempts': 10,
-        'mode': 'standard'
+        'mode': 'adaptive'
     }
 )
 
@@ -48,31 +49,55 @@ sns_client = boto3.client('sns', region_name='eu-west-3', config=aws_config)
 ORIGINAL_BUCKET_NAME = os.environ.get('ORIGINAL_BUCKET_NAME')  # The Original S3 Bucket name
 DYNAMODB_TABLE_NAME = "clinical_reports"  
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')  # Optional: For SNS notifications
+EXPECTED_RESULTS_BUCKET = os.environ.get('RESULT_BUCKET', 'clinical-reports-results')  # The Textract results bucket
+
+# Table handle is resolved once per container and reused across warm invocations
+TABLE = dynamodb.Table(DYNAMODB_TABLE_NAME)
+
+# Warm up during cold-start init: the first call resolves credentials and opens the TLS connection,
+# so the first real request doesn't pay for it. Failure here is not fatal; the handler reports real errors.
+try:
+    TABLE.load()
+    logger.info(f"DynamoDB Table '{DYNAMODB_TABLE_NAME}' is accessible.")
+except (ClientError, BotoCoreError) as e:
+    logger.warning(f"DynamoDB Table '{DYNAMODB_TABLE_NAME}' warm-up failed: {e}")
+
+# Worker pool for overlapping independent S3 reads, kept across warm invocations
+_EXECUTOR = ThreadPoolExecutor(max_workers=4)
 
 # Define processing states
 PROCESSING_STARTED = 'PROCESSING_STARTED'
 PROCESSING_FAILED = 'PROCESSING_FAILED'
 PROCESSING_COMPLETED = 'PROCESSING_COMPLETED'
 
-def retry_decorator(max_attempts=3, delay=2, exceptions=(Exception,)):
-    """
-    Retry decorator with exponential backoff.
-    """
-    def decorator_retry(func):
-        @functools.wraps(func)
-        def wrapper_retry(*args, **kwargs):
-            attempts = 0
-            while attempts < max_attempts:
-                try:
-                    return func(*args, **kwargs)
-                except exceptions as e:
-                    attempts += 1
-                    logger.warning(f"Attempt {attempts} failed with error: {e}. Retrying in {delay} seconds...")
-                    time.sleep(delay)
-            logger.error(f"All {max_attempts} attempts failed.")
-            raise
-        return wrapper_retry
-    return decorator_retry
+# Precompiled regex patterns used in the per-line and per-value hot paths
+_RE_ALPHA = re.compile(r"^[a-zA-Z\s]+$")
+_RE_NUM = re.compile(r"^\d+(\.\d+)?$")
+_RE_RANGE = re.compile(r"^\d+\s*[-–]\s*\d+$")
+_RE_UNIT = re.compile(r"[a-zA-Z]+\/[a-zA-Z]+$")
+_RE_REPORT = re.compile(r'report_(\d+)_textract\.json')
+
+# Static report fields and their patterns, in the order they are searched
+_STATIC_QUERIES = (
+    ("Laboratory Name", re.compile(r"(?i)laboratory name[:\-]?\s*(.*)")),
+    ("Patient Name", re.compile(r"(?i)patient name[:\-]?\s*(.*)")),
+    ("Collected On Date", re.compile(r"(?i)collected on[:\-]?\s*(.*)")),
+)
+
+class _DecimalCharTable(dict):
+    """
+    str.translate table that keeps digits, '.' and '-' and deletes every other character.
+    Each character's verdict is computed on first sight and cached in the dict.
+    """
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        self[codepoint] = codepoint if char.isdecimal() or char in '.-' else None
+        return self[codepoint]
+
+_DECIMAL_CHARS = _DecimalCharTable()
+
+# Keys of the extracted data that are report fields rather than indicators
+_NON_INDICATOR_KEYS = frozenset({"Laboratory Name", "Patient Name", "Collected On Date", "Error"})
 
 def log_processing_step(user_id, key, step, message=None):
     """
@@ -113,30 +138,32 @@ def validate_metadata(metadata):
     # Add more validation rules as needed
     # Add more validation rules as needed
 
-@retry_decorator(max_attempts=5, delay=3, exceptions=(ClientError,))
 def lambda_handler(event, context):
     """
     Lambda function handler to process S3 Textract result notifications and store in DynamoDB.
+    Records that hit an AWS or unexpected error are reported back as a partial batch failure,
+    so SQS redelivers just those; records that can never succeed are logged and dropped.
     """
-    logger.info(f"Received event: {json.dumps(event)}")
+    # Dumping the whole batch is only worth its cost when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Received event: {orjson.dumps(event).decode()}")
+    logger.info(f"Received {len(event.get('Records', []))} record(s).")
     
     # Validate environment variables
     if not ORIGINAL_BUCKET_NAME:
         logger.error("Environment variable 'ORIGINAL_BUCKET_NAME' is not set.")
         raise EnvironmentError("Missing 'ORIGINAL_BUCKET_NAME' environment variable.")
     
-    try:
-        table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        table.load()  # This will throw an exception if the table doesn't exist
-        logger.info(f"DynamoDB Table '{DYNAMODB_TABLE_NAME}' is accessible.")
-    except ClientError as e:
-        logger.error(f"DynamoDB Table '{DYNAMODB_TABLE_NAME}' does not exist or is inaccessible: {e}")
-        raise
+    failures = {}
 
+    # Parse the whole batch up front and start every S3 read right away,
+    # so later results are already downloading while earlier ones are processed
+    pending = []
     for record in event.get('Records', []):
+        message_id = record.get('messageId')
         try:
             # Parse the S3 event message
-            message_body = json.loads(record.get('body', '{}'))
+            message_body = orjson.loads(record.get('body', '{}'))
             s3_records = message_body.get('Records', [])
             for s3_record in s3_records:
                 # Extract bucket and key from the S3 event
@@ -144,117 +171,151 @@ def lambda_handler(event, context):
                 key = s3_record['s3']['object']['key']
 
                 # Ensure the record is from the Textract results bucket
-                if bucket != 'clinical-reports-results':  # Replace with your Textract results bucket name if different
-                    logger.warning(f"Ignoring message from bucket: {bucket}")
+                if bucket != EXPECTED_RESULTS_BUCKET:
                     continue  # Skip irrelevant messages
 
-                logger.info(f"Processing Textract result S3 object: s3://{bucket}/{key}")
-
                 # Parse S3 key to extract user_id and original_file_key
                 user_id, original_file_key = parse_s3_key(key)
 
-                original_key_1 = get_original_file_key(key)
-        
-                if original_key_1 != original_file_key:
-                    logger.error(f"Original file key mismatch: {original_key_1} != {original_file_key}")
-                    continue
-
-                # Log processing started
-                mark_state(PROCESSING_STARTED, user_id, key)
-
-                # Read Textract result JSON from S3
-                textract_data = read_textract_json(bucket, key)
+                # Cross-check against the alternative key conversion only when debugging
+                if logger.isEnabledFor(logging.DEBUG):
+                    original_key_1 = get_original_file_key(key)
+                    if original_key_1 != original_file_key:
+                        logger.error(f"Original file key mismatch: {original_key_1} != {original_file_key}")
+                        continue
 
                 # Generate metadata key based on original file key
                 metadata_key = get_metadata_key(original_file_key)
 
-                # Retrieve metadata from the Original S3 Bucket
-                metadata_bucket = ORIGINAL_BUCKET_NAME  # Retrieve metadata from the Original Bucket
-
-                logger.debug(f"Attempting to retrieve metadata from bucket: {metadata_bucket}, key: {metadata_key}")
-
-                try:
-                    metadata_response = s3_client.get_object(Bucket=metadata_bucket, Key=metadata_key)
-                    metadata_content = metadata_response['Body'].read().decode('utf-8')
-                    metadata = json.loads(metadata_content)
-                    logger.info(f"Successfully retrieved metadata from {metadata_bucket}/{metadata_key}")
-                except ClientError as e:
-                    if e.response['Error']['Code'] == 'NoSuchKey':
-                        logger.error(f"Metadata file {metadata_key} does not exist in bucket {metadata_bucket}.")
-                        mark_state(PROCESSING_FAILED, user_id, key)
-                        log_processing_step(user_id, key, PROCESSING_FAILED, "Metadata file missing.")
-                        # Optional: Notify via SNS
-                        if SNS_TOPIC_ARN:
-                            notify_missing_metadata(metadata_key, metadata_bucket)
-                        continue  # Skip further processing
-                    else:
-                        logger.error(f"AWS Client Error while fetching metadata: {e}")
-                        raise
-
-                # Validate metadata
-                try:
-                    validate_metadata(metadata)
-                except ValueError as ve:
-                    logger.error(f"Metadata validation failed: {ve}")
-                    mark_state(PROCESSING_FAILED, user_id, key)
-                    log_processing_step(user_id, key, PROCESSING_FAILED, f"Metadata validation failed: {ve}")
-                    continue  # Skip further processing
-
-                # Extract the 'indicators' from metadata
-                user_indicator = metadata.get('indicators')
-
-                # Ensure that 'user_indicator' is present
-                if not user_indicator:
-                    logger.error("No 'indicators' field found in metadata.")
-                    mark_state(PROCESSING_FAILED, user_id, key)
-                    log_processing_step(user_id, key, PROCESSING_FAILED, "Missing 'indicators' in metadata.")
-                    continue  # Skip further processing
-
-                # Extract relevant data using custom extraction logic with dynamic indicator
-                extracted_data = extract_text_with_queries(textract_data, user_indicator)
-
-                if "Error" in extracted_data:
-                    logger.error(extracted_data["Error"])
-                    mark_state(PROCESSING_FAILED, user_id, key)
-                    log_processing_step(user_id, key, PROCESSING_FAILED, extracted_data["Error"])
-                    continue  # Skip storing data if extraction failed
-
-                # Store results in DynamoDB using custom store_extracted_data
-                store_extracted_data(
-                    extracted_data,
-                    original_file_key,
-                    user_id,
-                    metadata.get('upload_date', 0),
-                    dynamodb,
-                    metadata
-                )
-
-                # Mark processing completed
-                mark_state(PROCESSING_COMPLETED, user_id, key)
+                # The Textract result and metadata reads are independent, so issue both GETs at once
+                textract_future = _EXECUTOR.submit(read_textract_json, bucket, key)
+                metadata_future = _EXECUTOR.submit(read_metadata_json, ORIGINAL_BUCKET_NAME, metadata_key)
+
+                pending.append((message_id, bucket, key, user_id, original_file_key, metadata_key, textract_future, metadata_future))
 
+        # Malformed messages and keys won't change on redelivery, so they are dropped
+        except KeyError as e:
+            logger.error(f"Missing expected key: {e}")
+        except ValueError as e:
+            logger.error(f"Invalid record: {e}")
+        except Exception as e:
+            logger.error(f"Error processing record: {e}")
+            failures[message_id] = None
+
+    for message_id, bucket, key, user_id, original_file_key, metadata_key, textract_future, metadata_future in pending:
+        try:
+            process_textract_result(bucket, key, user_id, original_file_key, metadata_key, textract_future, metadata_future)
         except KeyError as e:
             logger.error(f"Missing expected key: {e}")
         except ClientError as e:
             logger.error(f"AWS Client Error: {e}")
+            failures[message_id] = None
         except Exception as e:
             logger.error(f"Error processing record: {e}")
+            failures[message_id] = None
 
-    return {"status": "success", "message": "All messages processed successfully"}
+    # Dict keys dedupe message IDs while keeping batch order
+    return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]}
+
+def process_textract_result(bucket, key, user_id, original_file_key, metadata_key, textract_future, metadata_future):
+    """
+    Process one Textract result whose S3 reads were already started, and store the extracted data in DynamoDB.
+    """
+    logger.info(f"Processing Textract result S3 object: s3://{bucket}/{key}")
+
+    # Log processing started
+    mark_state(PROCESSING_STARTED, user_id, key)
+
+    # Retrieve metadata from the Original S3 Bucket
+    metadata_bucket = ORIGINAL_BUCKET_NAME  # Retrieve metadata from the Original Bucket
+
+    logger.debug(f"Attempting to retrieve metadata from bucket: {metadata_bucket}, key: {metadata_key}")
+
+    # Textract result body from S3, streamed during extraction; every exit path below closes it,
+    # including the early returns that never read it
+    textract_body = textract_future.result()
+    try:
+        try:
+            metadata = metadata_future.result()
+            logger.info(f"Successfully retrieved metadata from {metadata_bucket}/{metadata_key}")
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchKey':
+                logger.error(f"Metadata file {metadata_key} does not exist in bucket {metadata_bucket}.")
+                mark_state(PROCESSING_FAILED, user_id, key)
+                log_processing_step(user_id, key, PROCESSING_FAILED, "Metadata file missing.")
+                # Optional: Notify via SNS
+                if SNS_TOPIC_ARN:
+                    notify_missing_metadata(metadata_key, metadata_bucket)
+                return  # Skip further processing
+            else:
+                logger.error(f"AWS Client Error while fetching metadata: {e}")
+                raise
+
+        # Validate metadata
+        try:
+            validate_metadata(metadata)
+        except ValueError as ve:
+            logger.error(f"Metadata validation failed: {ve}")
+            mark_state(PROCESSING_FAILED, user_id, key)
+            log_processing_step(user_id, key, PROCESSING_FAILED, f"Metadata validation failed: {ve}")
+            return  # Skip further processing
+
+        # Extract the 'indicators' from metadata
+        user_indicator = metadata.get('indicators')
+
+        # Ensure that 'user_indicator' is present
+        if not user_indicator:
+            logger.error("No 'indicators' field found in metadata.")
+            mark_state(PROCESSING_FAILED, user_id, key)
+            log_processing_step(user_id, key, PROCESSING_FAILED, "Missing 'indicators' in metadata.")
+            return  # Skip further processing
+
+        # Extract relevant data using custom extraction logic with dynamic indicator
+        extracted_data = extract_text_with_queries(ijson.items(textract_body, 'Blocks.item'), user_indicator)
+
+        if "Error" in extracted_data:
+            logger.error(extracted_data["Error"])
+            mark_state(PROCESSING_FAILED, user_id, key)
+            log_processing_step(user_id, key, PROCESSING_FAILED, extracted_data["Error"])
+            return  # Skip storing data if extraction failed
+
+        # Store results in DynamoDB using custom store_extracted_data
+        store_extracted_data(
+            extracted_data,
+            original_file_key,
+            user_id,
+            metadata.get('upload_date', 0),
+            TABLE,
+            metadata
+        )
+
+        # Mark processing completed
+        mark_state(PROCESSING_COMPLETED, user_id, key)
+    finally:
+        textract_body.close()
 
 def read_textract_json(bucket, key):
     """
-    Read JSON content from S3.
+    Open the Textract result JSON in S3 for streaming.
+    Returns the unread response body; parse it incrementally with ijson so the whole document
+    is never held in memory at once, and close it when done so its connection goes back to the pool.
     """
     try:
         response = s3_client.get_object(Bucket=bucket, Key=key)
-        content = response['Body'].read()
-        textract_data = json.loads(content)
-        logger.info(f"Successfully read Textract JSON from s3://{bucket}/{key}")
-        return textract_data
+        logger.info(f"Streaming Textract JSON from s3://{bucket}/{key}")
+        return response['Body']
     except ClientError as e:
         logger.error(f"Error reading JSON from S3: {e}")
         raise
 
+def read_metadata_json(bucket, key):
+    """
+    Read and parse the upload metadata JSON from S3.
+    """
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    # orjson parses the raw bytes, so no separate UTF-8 decode pass is needed
+    return orjson.loads(response['Body'].read())
+
 def parse_s3_key(s3_key):
     """
     Parse S3 key to extract user ID and original file key.
@@ -270,7 +331,7 @@ def parse_s3_key(s3_key):
         textract_filename = parts[4]  # e.g., report_3_textract.json
 
         # Extract the report number using regex
-        match = re.match(r'report_(\d+)_textract\.json', textract_filename)
+        match = _RE_REPORT.match(textract_filename)
         if not match:
             raise ValueError("Textract filename does not match expected pattern.")
 
@@ -297,87 +358,100 @@ def safe_decimal_conversion(value, default=Decimal(0)):
     """
     try:
         # Remove any non-numeric characters except for the decimal point and negative sign
-        cleaned_value = re.sub(r'[^\d\.\-]', '', value)
+        cleaned_value = value.translate(_DECIMAL_CHARS)
         return Decimal(cleaned_value)
     except (InvalidOperation, ValueError) as e:
         logger.warning(f"Failed to convert '{value}' to Decimal. Using default value {default}. Error: {e}")
         return default
     
-def extract_text_with_queries(textract_data, user_indicator):
+def extract_text_with_queries(textract_blocks, user_indicator):
     """
     Extract text and fields from Textract data using custom extraction logic.
 
     Parameters:
-    - textract_data (dict): The JSON response from AWS Textract.
+    - textract_blocks (iterable): The Textract result blocks, e.g. as streamed by read_textract_json.
     - user_indicator (str): The indicator to search for within the Textract data.
 
     Returns:
     - dict: Extracted data with the specified indicator.
     """
     try:
-        # Extract LINE blocks from Textract response
-        blocks = textract_data.get('Blocks', [])
-        line_blocks = [block for block in blocks if block['BlockType'] == 'LINE']
-        logger.info(f"Extracted {len(line_blocks)} LINE blocks from Textract data.")
-
-        # Extract text from LINE blocks
-        lines = [line['Text'].strip() for line in line_blocks if 'Text' in line]
-
-        # Define regex patterns for static fields
-        queries = {
-            "Laboratory Name": r"(?i)laboratory name[:\-]?\s*(.*)",
-            "Patient Name": r"(?i)patient name[:\-]?\s*(.*)",
-            "Collected On Date": r"(?i)collected on[:\-]?\s*(.*)"
-        }
+        # Extract text from LINE blocks in one pass; other blocks are dropped as they stream past
+        lines = [block['Text'].strip() for block in textract_blocks if block.get('BlockType') == 'LINE' and 'Text' in block]
+        logger.info(f"Extracted {len(lines)} LINE blocks from Textract data.")
+
+        # Nothing to search
+        if not lines:
+            return {"Error": "No LINE blocks in Textract output."}
 
         # Initialize extracted data dictionary
         extracted_data = {}
 
-        # Extract static fields using regex patterns
-        for line in lines:
-            for query, pattern in queries.items():
-                if query not in extracted_data:  # Avoid overwriting once found
-                    match = re.search(pattern, line)
-                    if match:
-                        extracted_data[query] = match.group(1).strip()
-                        logger.info(f"Extracted {query}: {extracted_data[query]}")
+        # Static fields still to be found; each is dropped once matched so found fields stop being searched
+        pending_queries = list(_STATIC_QUERIES)
 
         # Handle dynamic indicators
         indicators, results, ranges, units = [], [], [], []
 
-        for i, line in enumerate(lines):
-            if re.match(r"^[a-zA-Z\s]+$", line):
-                next_line = lines[i + 1] if i + 1 < len(lines) else ""
-                if re.match(r"^\d+(\.\d+)?$", next_line):
-                    indicators.append(line)
+        # (index, match) of the numeric lookahead done for an indicator candidate, reused on the next line
+        num_lookahead = None
 
-            if re.match(r"^\d+(\.\d+)?$", line):
+        # Single pass: extract static fields, then classify the line by the first pattern it matches
+        for i, line in enumerate(lines):
+            for j in range(len(pending_queries) - 1, -1, -1):
+                query, pattern = pending_queries[j]
+                match = pattern.search(line)
+                if match:
+                    extracted_data[query] = match.group(1).strip()
+                    logger.info(f"Extracted {query}: {extracted_data[query]}")
+                    pending_queries.pop(j)
+
+            if num_lookahead and num_lookahead[0] == i:
+                num_match = num_lookahead[1]
+            else:
+                num_match = _RE_NUM.match(line)
+
+            if num_match:
                 results.append(line)
-            elif re.match(r"^\d+\s*[-–]\s*\d+$", line):
+            elif _RE_RANGE.match(line):
                 ranges.append(line)
-            elif re.match(r"[a-zA-Z]+\/[a-zA-Z]+$", line):
+            elif _RE_UNIT.match(line):
                 units.append(line)
+            elif _RE_ALPHA.match(line) and i + 1 < len(lines):
+                # An indicator name is an alphabetic line followed by a numeric result
+                num_lookahead = (i + 1, _RE_NUM.match(lines[i + 1]))
+                if num_lookahead[1]:
+                    indicators.append(line)
 
-        # Use the dynamic user_indicator for fuzzy matching
-        matched_indicator = process.extractOne(user_indicator, indicators, scorer=process.fuzz.partial_ratio)
-        if matched_indicator and matched_indicator[1] >= 80:
-            matched_indicator = matched_indicator[0]
-            logger.info(f"Matched indicator: {matched_indicator} with confidence {matched_indicator[1]}")
-        else:
-            matched_indicator = None
+        # No indicator candidates, so there's nothing for fuzzy matching to find
+        if not indicators:
             logger.warning(f"Indicator '{user_indicator}' not found or low confidence match.")
+            extracted_data["Error"] = f"Indicator '{user_indicator}' not found."
+            return extracted_data
 
-        if matched_indicator:
-            idx = indicators.index(matched_indicator)
+        # Use the dynamic user_indicator for fuzzy matching
+        # default_process lowercases and strips punctuation like fuzzywuzzy did; below the cutoff extractOne returns None
+        match_result = process.extractOne(
+            user_indicator,
+            indicators,
+            scorer=fuzz.partial_ratio,
+            processor=utils.default_process,
+            score_cutoff=80
+        )
+        if match_result:
+            # extractOne also returns the position of the match, so no indicators.index() scan is needed
+            matched_indicator, score, idx = match_result
+            logger.info(f"Matched indicator: {matched_indicator} with confidence {score}")
             extracted_data[matched_indicator] = {
                 "Result": results[idx] if idx < len(results) else "0",  # Default to "0" if missing
                 "Range": ranges[idx] if idx < len(ranges) else "0",    # Default to "0" if missing
                 "Units": units[idx] if idx < len(units) else "units"    # Default to "N/A" if missing
             }
         else:
+            logger.warning(f"Indicator '{user_indicator}' not found or low confidence match.")
             extracted_data["Error"] = f"Indicator '{user_indicator}' not found."
 
-        logger.info(f"Extracted data: {extracted_data}")
+        logger.debug("Extracted data: %s", extracted_data)
         return extracted_data
 
     except Exception as e:
@@ -391,17 +465,16 @@ def generate_patient_id(patient_name, collected_date, user_id):
     """
     patient_name = patient_name or ""
     raw_id = f"{user_id}_{patient_name}_{collected_date}"
-    patient_id = hashlib.sha256(raw_id.encode()).hexdigest()[:10]
+    patient_id = hashlib.blake2b(raw_id.encode(), digest_size=5).hexdigest()  # 10 hex chars
     logger.info(f"Generated Patient ID: {patient_id}")
     return patient_id
 
-def store_extracted_data(data, original_file_key, user_id, timestamp, dynamodb_resource, metadata):
+def store_extracted_data(data, original_file_key, user_id, timestamp, table, metadata):
     """
     Store extracted data in DynamoDB.
     """
     try:
-        logger.info(f"Using DynamoDB Table: {DYNAMODB_TABLE_NAME} in region: {dynamodb_resource.meta.client.meta.region_name}")
-        table = dynamodb_resource.Table(DYNAMODB_TABLE_NAME)
+        logger.info(f"Using DynamoDB Table: {table.name} in region: {table.meta.client.meta.region_name}")
 
         patient_name = data.get("Patient Name", "") 
         upload_date = metadata.get('upload_date')
@@ -413,40 +486,47 @@ def store_extracted_data(data, original_file_key, user_id, timestamp, dynamodb_r
         if not patient_id:
             patient_id = generate_patient_id(patient_name, upload_date, user_id)
         
-        for indicator, values in data.items():
-            if indicator not in ["Laboratory Name", "Patient Name", "Collected On Date", "Error"]:
-                # Safely handle Range conversion
-                range_str = values.get("Range", "0")
-                lower_range = safe_decimal_conversion(range_str.split("-")[0] if "-" in range_str else range_str)
-                upper_range = safe_decimal_conversion(range_str.split("-")[1]) if "-" in range_str else Decimal(0)
-                # collected_date = values.get("Collected On Date", "2025-01-21")
-                # Safely handle Result conversion
-                result_str = values.get("Result", "0")
-                result = safe_decimal_conversion(result_str)
-
-                units = values.get("Units", "N/A")
+        # batch_writer groups puts into BatchWriteItem calls (up to 25 items each) and retries unprocessed items;
+        # puts for the same key are collapsed to the last one, matching put_item's overwrite
+        with table.batch_writer(overwrite_by_pkeys=['UserId', 'PatientId#TestDateTime#Indicator']) as batch:
+            for indicator, values in data.items():
+                if indicator not in _NON_INDICATOR_KEYS:
+                    # Safely handle Range conversion
+                    range_str = values.get("Range", "0")
+                    if "-" in range_str:
+                        lower_str, _, upper_str = range_str.partition("-")
+                        lower_range = safe_decimal_conversion(lower_str)
+                        upper_range = safe_decimal_conversion(upper_str)
+                    else:
+                        lower_range = safe_decimal_conversion(range_str)
+                        upper_range = Decimal(0)
+                    # collected_date = values.get("Collected On Date", "2025-01-21")
+                    # Safely handle Result conversion
+                    result_str = values.get("Result", "0")
+                    result = safe_decimal_conversion(result_str)
+
+                    units = values.get("Units", "N/A")
                 
-                sort_key = f"{patient_id}#{upload_date}#{indicator}"
-
-                item = {
-                    "UserId": user_id,
-                    "PatientId#TestDateTime#Indicator": sort_key,
-                    "PatientId": patient_id,
-                    "PatientName": patient_name,
-                    "CollectedDate": collected_date,
-                    "UploadDate": upload_date,
-                    "LaboratoryName": laboratory_name,
-                    "Indicator": indicator,
-                    "Result": result,
-                    "Units": units,
-                    "LowerRange": lower_range,
-                    "UpperRange": upper_range,
-                    "S3FileKey": original_file_key,
-                }
-
-                logger.info(f"Attempting to store item in DynamoDB: {item}")
-                table.put_item(Item=item)
-                logger.info(f"Stored data for Indicator: {indicator} in DynamoDB.")
+                    sort_key = f"{patient_id}#{upload_date}#{indicator}"
+
+                    item = {
+                        "UserId": user_id,
+                        "PatientId#TestDateTime#Indicator": sort_key,
+                        "PatientId": patient_id,
+                        "PatientName": patient_name,
+                        "CollectedDate": collected_date,
+                        "UploadDate": upload_date,
+                        "LaboratoryName": laboratory_name,
+                        "Indicator": indicator,
+                        "Result": result,
+                        "Units": units,
+                        "LowerRange": lower_range,
+                        "UpperRange": upper_range,
+                        "S3FileKey": original_file_key,
+                    }
+
+                    batch.put_item(Item=item)
+                    logger.info(f"Queued data for Indicator: {indicator}, User: {user_id} for DynamoDB.")
 
         logger.info("All extracted data successfully stored in DynamoDB.")
 